@@ -5,6 +5,9 @@ Because authentication providers are instantiated and configured in the applicat
 (and not in the request handler), the authenticator implementations must be thread-safe.
 """
 import abc
+
+import six
+
 __authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
 __copyright__ = "Copyright 2009 Hans Lellelid"
 __license__ = """Licensed under the Apache License, Version 2.0 (the "License");
@@ -20,9 +23,15 @@ See the License for the specific language governing permissions and
 limitations under the License."""
 
 
+@six.add_metaclass(abc.ABCMeta)
 class Authenticator(object):
-    """ Abstract base class for authenticators. """
-    __metaclass__ = abc.ABCMeta
+    """
+    Abstract base class for authenticators.
+
+    This class declares empty C{__slots__}, so subclasses that declare their own
+    C{__slots__} do not carry a per-instance C{__dict__}.
+    """
+    __slots__ = ()
 
     @abc.abstractmethod
     def authenticate(self, login, passcode):
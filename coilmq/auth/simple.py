@@ -49,6 +49,7 @@ class SimpleAuthenticator(Authenticator):
     @ivar store:  Authentication key-value store (of logins to passwords).
     @type store: C{dict} of C{str} to C{str}
     """
+    __slots__ = ('store',)
 
     def __init__(self, store=None):
         """
@@ -160,6 +160,10 @@ class STOMP10(STOMP):
     def subscribe(self, frame):
         """
         Handle the SUBSCRIBE command: Adds this connection to destination.
+
+        Only an C{ack: client} subscription makes the connection a reliable subscriber;
+        otherwise (C{ack: auto}, the default) messages are not tracked as pending, so no
+        ACK bookkeeping is done for the connection at all.
         """
         ack = frame.headers.get('ack')
         reliable = ack and ack.lower() == 'client'
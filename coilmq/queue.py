@@ -4,13 +4,15 @@ Queue manager, queue implementation, and supporting classes.
 This code is inspired by the design of the Ruby stompserver project, by 
 Patrick Hurley and Lionel Bouton.  See http://stompserver.rubyforge.org/
 """
+import itertools
 import logging
 import threading
 import uuid
 from collections import defaultdict
 
+from six.moves import intern
+
 from coilmq.scheduler import FavorReliableSubscriberScheduler, RandomQueueScheduler
-from coilmq.util.concurrency import synchronized
 
 __authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
 __copyright__ = "Copyright 2009 Hans Lellelid"
@@ -26,19 +28,27 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License."""
 
-lock = threading.RLock()
+# Message ids are a process-unique prefix plus a sequence number; this is much
+# cheaper than generating a uuid (which reads from /dev/urandom) per message.
+_ID_PREFIX = uuid.uuid4().hex
+_id_counter = itertools.count()
 
 
 class QueueManager(object):
     """
     Class that manages distribution of messages to queue subscribers.
 
-    This class uses C{threading.RLock} to guard the public methods.  This is probably
-    a bit excessive, given 1) the actomic nature of basic C{dict} read/write operations 
-    and  2) the fact that most of the internal data structures are keying off of the 
-    STOMP connection, which is going to be thread-isolated.  That said, this seems like 
-    the technically correct approach and should increase the chance of this code being
-    portable to non-GIL systems. 
+    Locking is sharded by destination: each destination has its own C{threading.Lock}
+    guarding its subscriber set, its pending (un-ACK'd) frames and its store operations,
+    so that traffic to independent destinations does not serialize on a single lock.
+    A small manager-wide lock (C{_meta_lock}) guards only the mutation of the maps that
+    are keyed by destination.  In order to avoid deadlocks, the manager-wide lock is
+    only ever acquired after (never before) a destination lock, and no more than one
+    destination lock is held at a time.  The locks are not re-entrant; the private
+    methods that document that they expect a lock to be held must not acquire it again.
+    Frames that are taken back from a subscriber (on unsubscribe or disconnect) are
+    requeued after the destination lock has been released, since the stores are
+    thread-safe themselves and requeueing may involve a round-trip to the backend.
 
     @ivar store: The queue storage backend to use.
     @type store: L{coilmq.store.QueueStore}
@@ -51,17 +61,40 @@ class QueueManager(object):
                                     backlogs for a single connection.
     @type queue_scheduler: L{coilmq.scheduler.QueuePriorityScheduler}
 
+    @ivar backlog_batch_size: The maximum number of backlog frames that are removed from
+                                the store (and sent) at once to a non-reliable subscriber.
+    @type backlog_batch_size: C{int}
+
     @ivar _queues: A dict of registered queues, keyed by destination.
     @type _queues: C{dict} of C{str} to C{set} of L{coilmq.server.StompConnection}
 
-    @ivar _pending: All messages waiting for ACK from clients.
-    @type _pending: C{dict} of L{coilmq.server.StompConnection} to C{stompclient.frame.Frame}
+    @ivar _transaction_frames: Frames that have been ACK'd within a transaction, keyed by
+                                connection and transaction id.  (Entries are only created
+                                for connections that ACK within a transaction.)
+    @type _transaction_frames: C{dict} of L{coilmq.server.StompConnection} to C{dict} of C{str} to C{list} of C{stompclient.frame.Frame}
+
+    @ivar _free: The subscribers of each destination that do not have a pending frame
+                    for that destination (i.e. those eligible to receive a message).
+    @type _free: C{dict} of C{str} to C{set} of L{coilmq.server.StompConnection}
+
+    @ivar _conn_subs: The destinations each connection is subscribed to (reverse index of C{_queues}).
+    @type _conn_subs: C{dict} of L{coilmq.server.StompConnection} to C{set} of C{str}
 
-    @ivar _transaction_frames: Frames that have been ACK'd within a transaction.
-    @type _transaction_frames: C{dict} of L{coilmq.server.StompConnection} to C{dict} of C{str} to C{stompclient.frame.Frame}
+    @ivar _dest_locks: The per-destination locks.  A lock is created when a destination is
+                        first subscribed or sent to and is kept for the lifetime of the
+                        manager (so this map is not bounded), since removing a lock that
+                        another thread may be waiting for would break mutual exclusion.
+    @type _dest_locks: C{dict} of C{str} to C{threading.Lock}
+
+    @ivar _meta_lock: Lock guarding the mutation of the destination-keyed maps.
+    @type _meta_lock: C{threading.Lock}
     """
+    # Fixed attribute layout, since these are read on every send/ack.
+    __slots__ = ('log', 'store', 'subscriber_scheduler', 'queue_scheduler', 'backlog_batch_size',
+                 '_meta_lock', '_dest_locks', '_queues', '_free',
+                 '_conn_subs', '_transaction_frames')
 
-    def __init__(self, store, subscriber_scheduler=None, queue_scheduler=None):
+    def __init__(self, store, subscriber_scheduler=None, queue_scheduler=None, backlog_batch_size=256):
         """
         @param store: The queue storage backend.
         @type store: L{coilmq.store.QueueStore}
@@ -73,7 +106,16 @@ class QueueManager(object):
         @param queue_scheduler: The scheduler that chooses which queue to select for sending
                                     backlogs for a single connection.
         @type queue_scheduler: L{coilmq.scheduler.QueuePriorityScheduler}
+
+        @param backlog_batch_size: The maximum number of backlog frames that are sent at once
+                                    to a non-reliable subscriber.
+        @type backlog_batch_size: C{int}
+
+        @raise ValueError: if the backlog batch size is less than 1.
         """
+        if backlog_batch_size < 1:
+            raise ValueError("Invalid backlog batch size: %r" % backlog_batch_size)
+
         self.log = logging.getLogger(
             '%s.%s' % (__name__, self.__class__.__name__))
 
@@ -84,33 +126,34 @@ class QueueManager(object):
         if queue_scheduler is None:
             queue_scheduler = RandomQueueScheduler()
 
-        # This lock var is required by L{synchronized} decorator.
-        self._lock = threading.RLock()
+        self._meta_lock = threading.Lock()
+        self._dest_locks = defaultdict(threading.Lock)
 
         self.store = store
         self.subscriber_scheduler = subscriber_scheduler
         self.queue_scheduler = queue_scheduler
+        self.backlog_batch_size = backlog_batch_size
 
         self._queues = defaultdict(set)
-        self._transaction_frames = defaultdict(lambda: defaultdict(list))
-        self._pending = {}
+        self._free = defaultdict(set)
+        self._conn_subs = defaultdict(set)
+        self._transaction_frames = {}
 
-    @synchronized(lock)
     def close(self):
         """
         Closes all resources/backends associated with this queue manager.
         """
-        self.log.info("Shutting down queue manager.")
-        if hasattr(self.store, 'close'):
-            self.store.close()
+        with self._meta_lock:
+            self.log.info("Shutting down queue manager.")
+            if hasattr(self.store, 'close'):
+                self.store.close()
 
-        if hasattr(self.subscriber_scheduler, 'close'):
-            self.subscriber_scheduler.close()
+            if hasattr(self.subscriber_scheduler, 'close'):
+                self.subscriber_scheduler.close()
 
-        if hasattr(self.queue_scheduler, 'close'):
-            self.queue_scheduler.close()
+            if hasattr(self.queue_scheduler, 'close'):
+                self.queue_scheduler.close()
 
-    @synchronized(lock)
     def subscriber_count(self, destination=None):
         """
         Returns a count of the number of subscribers.
@@ -119,18 +162,18 @@ class QueueManager(object):
         for that specific destination.
 
         @param destination: The optional topic/queue destination (e.g. '/queue/foo')
-        @type destination: C{str}
+        @type destination: C{str} 
         """
-        if destination:
-            return len(self._queues[destination])
-        else:
-            # total them up
-            total = 0
-            for k in self._queues.keys():
-                total += len(self._queues[k])
-            return total
+        with self._meta_lock:
+            if destination:
+                return len(self._queues.get(destination, ()))
+            else:
+                # total them up
+                total = 0
+                for k in self._queues.keys():
+                    total += len(self._queues[k])
+                return total
 
-    @synchronized(lock)
     def subscribe(self, connection, destination):
         """
         Subscribes a connection to the specified destination (topic or queue). 
@@ -141,29 +184,60 @@ class QueueManager(object):
         @param destination: The topic/queue destination (e.g. '/queue/foo')
         @type destination: C{str} 
         """
-        self.log.debug("Subscribing %s to %s" % (connection, destination))
-        self._queues[destination].add(connection)
-        self._send_backlog(connection, destination)
+        self.log.debug("Subscribing %s to %s", connection, destination)
+        destination = self._route(destination)
+        with self._lock_for(destination):
+            with self._meta_lock:
+                subscribers = self._queues[destination]
+                free = self._free[destination]
+                self._conn_subs[connection].add(destination)
+                if getattr(connection, 'pending_frames', None) is None:
+                    connection.pending_frames = {}
+            subscribers.add(connection)
+            if destination not in connection.pending_frames:
+                free.add(connection)
+            self._send_backlog(connection, destination)
 
-    @synchronized(lock)
     def unsubscribe(self, connection, destination):
         """
         Unsubscribes a connection from a destination (topic or queue).
 
+        Any frame pending (waiting for ACK) for the destination gets requeued.
+
         @param connection: The client connection to unsubscribe.
         @type connection: L{coilmq.server.StompConnection}
 
         @param destination: The topic/queue destination (e.g. '/queue/foo')
         @type destination: C{str} 
         """
-        self.log.debug("Unsubscribing %s from %s" % (connection, destination))
-        if connection in self._queues[destination]:
-            self._queues[destination].remove(connection)
+        self.log.debug("Unsubscribing %s from %s", connection, destination)
+        dest_lock = self._dest_locks.get(destination)
+        if dest_lock is None:
+            # (Never subscribed to, so there is nothing to do.)
+            return
+        with dest_lock:
+            subscribers = self._queues.get(destination)
+            if subscribers is None or connection not in subscribers:
+                return
+
+            pending_frame = connection.pending_frames.pop(destination, None)
 
-        if not self._queues[destination]:
-            del self._queues[destination]
+            with self._meta_lock:
+                subscribers.discard(connection)
+                self._free[destination].discard(connection)
+                if not subscribers:
+                    del self._queues[destination]
+                    del self._free[destination]
+
+                subscriptions = self._conn_subs.get(connection)
+                if subscriptions is not None:
+                    subscriptions.discard(destination)
+                    if not subscriptions:
+                        del self._conn_subs[connection]
+
+        if pending_frame is not None:
+            self._requeue(destination, pending_frame)
 
-    @synchronized(lock)
     def disconnect(self, connection):
         """
         Removes a subscriber connection, ensuring that any pending commands get requeued.
@@ -171,21 +245,28 @@ class QueueManager(object):
         @param connection: The client connection to unsubscribe.
         @type connection: L{coilmq.server.StompConnection}
         """
-        self.log.debug("Disconnecting %s" % connection)
-        if connection in self._pending:
-            pending_frame = self._pending[connection]
-            self.store.requeue(pending_frame.headers.get(
-                'destination'), pending_frame)
-            del self._pending[connection]
-
-        for dest in list(self._queues.keys()):
-            if connection in self._queues[dest]:
-                self._queues[dest].remove(connection)
-            if not self._queues[dest]:
-                # This won't trigger RuntimeError, since we're using keys()
-                del self._queues[dest]
-
-    @synchronized(lock)
+        self.log.debug("Disconnecting %s", connection)
+        with self._meta_lock:
+            # (Frames are only pending for destinations the connection is subscribed to.)
+            destinations = self._conn_subs.pop(connection, ())
+            self._transaction_frames.pop(connection, None)
+
+        for dest in destinations:
+            with self._lock_for(dest):
+                pending_frame = connection.pending_frames.pop(dest, None)
+
+                with self._meta_lock:
+                    subscribers = self._queues.get(dest)
+                    if subscribers is not None:
+                        subscribers.discard(connection)
+                        self._free[dest].discard(connection)
+                        if not subscribers:
+                            del self._queues[dest]
+                            del self._free[dest]
+
+            if pending_frame is not None:
+                self._requeue(dest, pending_frame)
+
     def send(self, message):
         """
         Sends a MESSAGE frame to an eligible subscriber connection.
@@ -197,31 +278,21 @@ class QueueManager(object):
         @param message: The message frame.
         @type message: C{stompclient.frame.Frame}
         """
-        dest = message.headers.get('destination')
+        headers = message.headers
+        dest = headers.get('destination')
         if not dest:
             raise ValueError(
                 "Cannot send frame with no destination: %s" % message)
+        dest = self._route(dest)
 
         message.cmd = 'message'
 
-        message.headers.setdefault('message-id', str(uuid.uuid4()))
+        if 'message-id' not in headers:
+            headers['message-id'] = '%s-%d' % (_ID_PREFIX, next(_id_counter))
 
-        # Grab all subscribers for this destination that do not have pending
-        # frames
-        subscribers = [s for s in self._queues[dest]
-                       if s not in self._pending]
+        with self._lock_for(dest):
+            self._dispatch(dest, message)
 
-        if not subscribers:
-            self.log.debug(
-                "No eligible subscribers; adding message %s to queue %s" % (message, dest))
-            self.store.enqueue(dest, message)
-        else:
-            selected = self.subscriber_scheduler.choice(subscribers, message)
-            self.log.debug("Delivering message %s to subscriber %s" %
-                           (message, selected))
-            self._send_frame(selected, message)
-
-    @synchronized(lock)
     def ack(self, connection, frame, transaction=None):
         """
         Acknowledge receipt of a message.
@@ -230,35 +301,47 @@ class QueueManager(object):
         will be queued so that it can be requeued if the transaction
         is rolled back. 
 
+        An ACK that does not match any of the connection's pending frames (e.g. a
+        duplicate ACK) is logged and otherwise ignored; the pending frames stay pending.
+
         @param connection: The connection that is acknowledging the frame.
         @type connection: L{coilmq.server.StompConnection}
 
         @param frame: The frame being acknowledged.
 
         """
-        self.log.debug("ACK %s for %s" % (frame, connection))
-
-        if connection in self._pending:
-            pending_frame = self._pending[connection]
-            # Make sure that the frame being acknowledged matches
-            # the expected frame
-            if pending_frame.headers.get('message-id') != frame.headers.get('message-id'):
-                self.log.warning(
-                    "Got a ACK for unexpected message-id: %s" % frame.message_id)
-                self.store.requeue(pending_frame.destination, pending_frame)
-                # (The pending frame will be removed further down)
-
-            if transaction is not None:
-                self._transaction_frames[connection][
-                    transaction].append(pending_frame)
-
-            del self._pending[connection]
-            self._send_backlog(connection)
-
+        self.log.debug("ACK %s for %s", frame, connection)
+
+        message_id = frame.headers.get('message-id')
+        pending_frames = getattr(connection, 'pending_frames', None)
+        if not pending_frames:
+            self.log.debug("No pending messages for %s", connection)
+            return
+
+        for dest, pending_frame in list(pending_frames.items()):
+            if pending_frame.headers.get('message-id') != message_id:
+                continue
+            with self._lock_for(dest):
+                # The frame may have been requeued (e.g. by an unsubscribe) meanwhile
+                if pending_frames.get(dest) is not pending_frame:
+                    continue
+
+                if transaction is not None:
+                    with self._meta_lock:
+                        self._transaction_frames.setdefault(connection, {}).setdefault(
+                            transaction, []).append(pending_frame)
+
+                del pending_frames[dest]
+                if connection in self._queues.get(dest, ()):
+                    self._free[dest].add(connection)
+                break
         else:
-            self.log.debug("No pending messages for %s" % connection)
+            self.log.warning(
+                "Got a ACK for unexpected message-id: %s", message_id)
+            return
+
+        self._send_subscriber_backlog(connection)
 
-    @synchronized(lock)
     def resend_transaction_frames(self, connection, transaction):
         """
         Resend the messages that were ACK'd in specified transaction.
@@ -271,10 +354,14 @@ class QueueManager(object):
         @param transaction: The transaction id (which was aborted).
         @type transaction: C{str}
         """
-        for frame in self._transaction_frames[connection][transaction]:
-            self.send(frame)
+        with self._meta_lock:
+            frames = self._pop_transaction_frames(connection, transaction)
+        for frame in frames:
+            # These frames have already been prepared by send()
+            dest = self._route(frame.headers.get('destination'))
+            with self._lock_for(dest):
+                self._dispatch(dest, frame)
 
-    @synchronized(lock)
     def clear_transaction_frames(self, connection, transaction):
         """
         Clears out the queued ACK frames for specified transaction. 
@@ -287,21 +374,160 @@ class QueueManager(object):
         @param transaction: The transaction id (which was committed).
         @type transaction: C{str}
         """
-        try:
-            del self._transaction_frames[connection][transaction]
-        except KeyError:
+        with self._meta_lock:
             # There may not have been any ACK frames for this transaction.
-            pass
+            self._pop_transaction_frames(connection, transaction)
+
+    def _pop_transaction_frames(self, connection, transaction):
+        """
+        Removes and returns the frames ACK'd by a connection within the specified transaction.
+
+        (This method assumes it is being called with the meta lock held.)
+
+        @param connection: The client connection.
+        @type connection: L{coilmq.server.StompConnection}
 
-    def _send_backlog(self, connection, destination=None):
+        @param transaction: The transaction id.
+        @type transaction: C{str}
+
+        @rtype: C{list} of C{stompclient.frame.Frame}
         """
-        Sends any queued-up messages for the (optionally) specified destination to connection.
+        transactions = self._transaction_frames.get(connection)
+        if not transactions:
+            return ()
+        frames = transactions.pop(transaction, ())
+        if not transactions:
+            del self._transaction_frames[connection]
+        return frames
+
+    def _requeue(self, destination, frame):
+        """
+        Requeues a frame that was taken back from a subscriber and sends the backlog to
+        one of the eligible subscribers for the destination (if any).
+
+        Eligible subscribers only receive frames from the store when they are sent a
+        backlog, so without this the requeued frame would wait for the next ACK (or,
+        if there are only non-reliable subscribers, forever).  Errors sending the
+        backlog are logged rather than raised, since they concern another connection.
 
-        If the destination is not provided, a destination is chosen using the 
-        L{QueueManager.queue_scheduler} scheduler algorithm.
+        (This method must not be called with a destination lock held.)
 
-        (This method assumes it is being called from within a lock-guarded public
-        method.)  
+        @param destination: The (routed) destination of the frame.
+        @type destination: C{str}
+
+        @param frame: The frame to requeue.
+        @type frame: C{stompclient.frame.Frame}
+        """
+        self.store.requeue(destination, frame)
+        with self._lock_for(destination):
+            subscribers = self._free.get(destination)
+            if not subscribers:
+                return
+            selected = self.subscriber_scheduler.choice(subscribers, frame)
+            try:
+                self._send_backlog(selected, destination)
+            except Exception:
+                self.log.exception(
+                    "Error sending backlog for %s to subscriber %s", destination, selected)
+
+    def _route(self, destination):
+        """
+        Returns the interned key for the specified destination.
+
+        Using the same (interned) string object as the key for all of the destination-keyed
+        maps means that repeated lookups for a destination compare by identity.  Only
+        (exact) C{str} values can be interned; anything else (e.g. C{unicode} header values
+        on Python 2) is used as-is.
+
+        @param destination: The topic/queue destination (e.g. '/queue/foo')
+        @type destination: C{str}
+
+        @rtype: C{str}
+        """
+        if type(destination) is str:
+            return intern(destination)
+        return destination
+
+    def _lock_for(self, destination):
+        """
+        Returns the lock guarding the specified destination, creating it if necessary.
+
+        @param destination: The topic/queue destination (e.g. '/queue/foo')
+        @type destination: C{str} 
+
+        @rtype: C{threading.Lock}
+        """
+        dest_lock = self._dest_locks.get(destination)
+        if dest_lock is None:
+            with self._meta_lock:
+                dest_lock = self._dest_locks[destination]
+        return dest_lock
+
+    def _dispatch(self, destination, message):
+        """
+        Sends a (prepared) MESSAGE frame to an eligible subscriber or, if there is none,
+        adds it to the store.
+
+        (This method assumes it is being called with the lock for the destination held.)
+
+        @param destination: The (routed) destination of the message.
+        @type destination: C{str}
+
+        @param message: The message frame.
+        @type message: C{stompclient.frame.Frame}
+        """
+        # All subscribers for this destination that do not have pending frames
+        subscribers = self._free.get(destination)
+
+        if not subscribers:
+            self.log.debug(
+                "No eligible subscribers; adding message %s to queue %s", message, destination)
+            self.store.enqueue(destination, message)
+        else:
+            selected = self.subscriber_scheduler.choice(subscribers, message)
+            self.log.debug("Delivering message %s to subscriber %s", message, selected)
+            if selected.reliable_subscriber:
+                self._send_frame_reliable(selected, destination, message)
+            else:
+                self._send_frame_unreliable(selected, message)
+
+    def _send_subscriber_backlog(self, connection):
+        """
+        Sends queued-up messages for one of the destinations the connection is subscribed to.
+
+        The destination is chosen using the L{QueueManager.queue_scheduler} scheduler
+        algorithm, from the destinations that have frames and for which the connection
+        does not have a pending frame.
+
+        (This method must not be called with a destination lock held.)
+
+        @param connection: The client connection.
+        @type connection: L{coilmq.server.StompConnection}
+        """
+        with self._meta_lock:
+            destinations = tuple(self._conn_subs.get(connection, ()))
+
+        # Find all destinations that this connection (subscriber) is subscribed
+        # to and that have frames.
+        eligible_queues = dict((dest, self._queues.get(dest)) for dest in destinations
+                               if connection in self._free.get(dest, ())
+                               and self.store.has_frames(dest))
+        destination = self.queue_scheduler.choice(
+            eligible_queues, connection)
+        if destination is None:
+            self.log.debug(
+                "No eligible queues (with frames) for subscriber %s", connection)
+            return
+
+        with self._lock_for(destination):
+            if connection in self._queues.get(destination, ()):
+                self._send_backlog(connection, destination)
+
+    def _send_backlog(self, connection, destination):
+        """
+        Sends any queued-up messages for the specified destination to connection.
+
+        (This method assumes it is being called with the lock for the destination held.)
 
         @param connection: The client connection.
         @type connection: L{coilmq.server.StompConnection}
@@ -312,65 +538,88 @@ class QueueManager(object):
         @raise Exception: if the underlying connection object raises an error, the message
                             will be re-queued and the error will be re-raised.  
         """
-        if destination is None:
-            # Find all destinations that have frames and that contain this
-            # connection (subscriber).
-            eligible_queues = dict([(dest, q) for (dest, q) in self._queues.items()
-                                    if connection in q and self.store.has_frames(dest)])
-            destination = self.queue_scheduler.choice(
-                eligible_queues, connection)
-            if destination is None:
-                self.log.debug(
-                    "No eligible queues (with frames) for subscriber %s" % connection)
-                return
-
-        self.log.debug("Sending backlog to %s for destination %s" %
-                       (connection, destination))
+        self.log.debug("Sending backlog to %s for destination %s", connection, destination)
         if connection.reliable_subscriber:
+            if destination in connection.pending_frames:
+                # still waiting for ack of a previously sent frame
+                return
             # only send one message (waiting for ack)
             frame = self.store.dequeue(destination)
             if frame:
                 try:
-                    self._send_frame(connection, frame)
+                    self._send_frame_reliable(connection, destination, frame)
                 except Exception as x:
                     self.log.error(
-                        "Error sending message %s (requeueing): %s" % (frame, x))
+                        "Error sending message %s (requeueing): %s", frame, x)
                     self.store.requeue(destination, frame)
                     raise
+        elif hasattr(connection, 'send_frames'):
+            # send the backlog in batches, each removed from the store at once
+            frames = self.store.drain(destination, self.backlog_batch_size)
+            while frames:
+                self.log.debug("Delivering %d frames to connection %s", len(frames), connection)
+                try:
+                    connection.send_frames(frames)
+                except Exception as x:
+                    self.log.error(
+                        "Error sending %d messages (requeueing): %s", len(frames), x)
+                    for frame in frames:
+                        self.store.requeue(destination, frame)
+                    raise
+                frames = self.store.drain(destination, self.backlog_batch_size)
         else:
             for frame in self.store.frames(destination):
                 try:
-                    self._send_frame(connection, frame)
+                    self._send_frame_unreliable(connection, frame)
                 except Exception as x:
                     self.log.error(
-                        "Error sending message %s (requeueing): %s" % (frame, x))
+                        "Error sending message %s (requeueing): %s", frame, x)
                     self.store.requeue(destination, frame)
                     raise
 
-    def _send_frame(self, connection, frame):
+    def _send_frame_reliable(self, connection, destination, frame):
         """
-        Sends a frame to a specific subscriber connection.
+        Sends a frame to a specific reliable subscriber connection, tracking it as pending
+        (waiting for ACK).
 
-        (This method assumes it is being called from within a lock-guarded public
-        method.)
+        (This method assumes it is being called with the lock for the destination held.)
 
-        @param connection: The subscriber connection object to send to.
+        @param connection: The (reliable) subscriber connection object to send to.
         @type connection: L{coilmq.server.StompConnection}
 
+        @param destination: The (routed) destination of the frame.
+        @type destination: C{str}
+
         @param frame: The frame to send.
         @type frame: L{stompclient.frame.Frame}
         """
         assert connection is not None
         assert frame is not None
 
-        self.log.debug("Delivering frame %s to connection %s" %
-                       (frame, connection))
+        pending_frames = connection.pending_frames
+        if destination in pending_frames:
+            raise RuntimeError("Connection already has a pending frame.")
+        self.log.debug(
+            "Tracking frame %s as pending for connection %s", frame, connection)
+        pending_frames[destination] = frame
+        free = self._free.get(destination)
+        if free is not None:
+            free.discard(connection)
 
-        if connection.reliable_subscriber:
-            if connection in self._pending:
-                raise RuntimeError("Connection already has a pending frame.")
-            self.log.debug(
-                "Tracking frame %s as pending for connection %s" % (frame, connection))
-            self._pending[connection] = frame
+        connection.send_frame(frame)
+
+    def _send_frame_unreliable(self, connection, frame):
+        """
+        Sends a frame to a specific non-reliable subscriber connection.
+
+        @param connection: The (non-reliable) subscriber connection object to send to.
+        @type connection: L{coilmq.server.StompConnection}
+
+        @param frame: The frame to send.
+        @type frame: L{stompclient.frame.Frame}
+        """
+        assert connection is not None
+        assert frame is not None
 
+        self.log.debug("Delivering frame %s to connection %s", frame, connection)
         connection.send_frame(frame)
@@ -35,7 +35,7 @@ class SubscriberPriorityScheduler(object):
         Chooses which subscriber (from list) should recieve specified message.
 
         @param subscribers: Collection of subscribed connections eligible to receive message. 
-        @type subscribers: C{list} of L{coilmq.server.StompConnection}
+        @type subscribers: C{list} or C{set} of L{coilmq.server.StompConnection}
 
         @param message: The message to be delivered. 
         @type message: L{stompclient.frame.Frame}
@@ -75,7 +75,7 @@ class RandomSubscriberScheduler(SubscriberPriorityScheduler):
         Chooses a random connection from subscribers to deliver specified message.
 
         @param subscribers: Collection of subscribed connections to destination. 
-        @type subscribers: C{list} of L{coilmq.server.StompConnection}
+        @type subscribers: C{list} or C{set} of L{coilmq.server.StompConnection}
 
         @param message: The message to be delivered. 
         @type message: L{stompclient.frame.Frame}
@@ -85,7 +85,7 @@ class RandomSubscriberScheduler(SubscriberPriorityScheduler):
         """
         if not subscribers:
             return None
-        return random.choice(subscribers)
+        return random.choice(list(subscribers))
 
 
 class FavorReliableSubscriberScheduler(SubscriberPriorityScheduler):
@@ -99,7 +99,7 @@ class FavorReliableSubscriberScheduler(SubscriberPriorityScheduler):
         subscriber pool to deliver specified message.
 
         @param subscribers: Collection of subscribed connections to destination. 
-        @type subscribers: C{list} of L{coilmq.server.StompConnection}
+        @type subscribers: C{list} or C{set} of L{coilmq.server.StompConnection}
 
         @param message: The message to be delivered. 
         @type message: L{stompclient.frame.Frame}
@@ -114,7 +114,7 @@ class FavorReliableSubscriberScheduler(SubscriberPriorityScheduler):
         if reliable_subscribers:
             return random.choice(reliable_subscribers)
         else:
-            return random.choice(subscribers)
+            return random.choice(list(subscribers))
 
 
 class RandomQueueScheduler(QueuePriorityScheduler):
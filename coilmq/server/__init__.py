@@ -29,10 +29,16 @@ class StompConnection(object):
 
     @ivar reliable_subscriber: Whether this client will ACK all messages.
     @type reliable_subscriber: C{bool}
+
+    @ivar pending_frames: The frames sent to this client that are waiting for ACK, keyed by
+                            destination.  (This is managed by the queue manager, which sets
+                            it when the connection first subscribes to a queue.)
+    @type pending_frames: C{dict} of C{str} to C{stompclient.frame.Frame}
     """
     __metaclass__ = abc.ABCMeta
 
     reliable_subscriber = False
+    pending_frames = None
 
     @abc.abstractmethod
     def send_frame(self, frame):
@@ -42,3 +48,16 @@ class StompConnection(object):
         @param frame: The STOMP frame to send.
         @type frame: C{stompclient.frame.Frame}  
         """
+
+    def send_frames(self, frames):
+        """
+        Uses this connection implementation to send several frames to a connected client.
+
+        The default implementation calls L{send_frame} for each frame; implementations
+        should override this if they are able to send the frames in a single write.
+
+        @param frames: The STOMP frames to send.
+        @type frames: C{list} of C{stompclient.frame.Frame}
+        """
+        for frame in frames:
+            self.send_frame(frame)
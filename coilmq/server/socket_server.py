@@ -8,6 +8,10 @@ try:
     from socketserver import BaseRequestHandler, TCPServer, ThreadingMixIn
 except ImportError:
     from SocketServer import BaseRequestHandler, TCPServer, ThreadingMixIn
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
 
 from coilmq.util.frames import FrameBuffer
@@ -40,6 +44,17 @@ class StompRequestHandler(BaseRequestHandler, StompConnection):
     storage containers configured into the engine are not thread-local (and hence must be
     thread-safe). 
 
+    Outbound frames are not written to the socket by the thread that sends them; they are
+    put on a queue that is served by a dedicated writer thread for the connection.  This
+    way a slow client does not hold up the (locked) broker operations that deliver frames
+    to it (until L{out_queue_size} writes are waiting, at which point sending blocks).
+    Once writing to the socket has failed, sending raises L{ClientDisconnected}, so that
+    the caller can requeue the frames or disconnect the client.
+
+    @cvar out_queue_size: The maximum number of (packed) frames or batches of frames
+                            waiting to be written to the socket.
+    @type out_queue_size: C{int}
+
     @ivar buffer: A StompBuffer instance which buffers received data (to ensure we deal with
                     complete STOMP messages.
     @type buffer: C{stompclient.util.FrameBuffer}
@@ -49,14 +64,31 @@ class StompRequestHandler(BaseRequestHandler, StompConnection):
 
     @ivar debug: Whether to enable extra-verbose debug logging.  (Will be logged at debug level.)
     @type debug: C{bool}
+
+    @ivar _out_q: The queue of packed frames waiting to be written to the socket.
+    @type _out_q: C{Queue.Queue}
+
+    @ivar _writer: The thread writing the queued frames to the socket.
+    @type _writer: C{threading.Thread}
+
+    @ivar _closed: Set (by the writer thread) when writing to the socket has failed.
+    @type _closed: C{threading.Event}
     """
 
+    out_queue_size = 1000
+
     def setup(self):
         if self.server.timeout is not None:
             self.request.settimeout(self.server.timeout)
         self.debug = False
         self.log = logging.getLogger('%s.%s' % (self.__module__, self.__class__.__name__))
         self.buffer = FrameBuffer()
+        self._out_q = Queue(self.out_queue_size)
+        self._closed = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop,
+                                        name='%s-writer' % threading.current_thread().name)
+        self._writer.daemon = True
+        self._writer.start()
         self.engine = StompEngine(connection=self,
                                   authenticator=self.server.authenticator,
                                   queue_manager=self.server.queue_manager,
@@ -75,11 +107,11 @@ class StompRequestHandler(BaseRequestHandler, StompConnection):
                     if not data:
                         break
                     if self.debug:
-                        self.log.debug("RECV: %r" % data)
+                        self.log.debug("RECV: %r", data)
                     self.buffer.append(data)
 
                     for frame in self.buffer:
-                        self.log.debug("Processing frame: %s" % frame)
+                        self.log.debug("Processing frame: %s", frame)
                         self.engine.process_frame(frame)
                         if not self.engine.connected:
                             raise ClientDisconnected()
@@ -88,7 +120,7 @@ class StompRequestHandler(BaseRequestHandler, StompConnection):
         except ClientDisconnected:
             self.log.debug("Client disconnected, discontinuing read loop.")
         except Exception as e:  # pragma: no cover
-            self.log.error("Error receiving data (unbinding): %s" % e)
+            self.log.error("Error receiving data (unbinding): %s", e)
             self.engine.unbind()
             raise
 
@@ -96,21 +128,64 @@ class StompRequestHandler(BaseRequestHandler, StompConnection):
         """
         Normal (non-error) termination of request.
 
-        Unbinds the engine.
+        Unbinds the engine and waits for the queued frames to be written.
         @see: L{coilmq.engine.StompEngine.unbind}
         """
         self.engine.unbind()
+        self._out_q.put(None)
+        self._writer.join()
 
     def send_frame(self, frame):
         """ Sends a frame to connected socket client.
 
+        The frame is packed immediately, but written to the socket by the writer thread.
+
         @param frame: The frame to send.
         @type frame: C{stompclient.frame.Frame}
+
+        @raise ClientDisconnected: if writing to the socket has failed.
         """
-        packed = frame.pack()
-        if self.debug:  # pragma: no cover
-            self.log.debug("SEND: %r" % packed)
-        self.request.sendall(packed)
+        if self._closed.is_set():
+            raise ClientDisconnected()
+        self._out_q.put(frame.pack())
+
+    def send_frames(self, frames):
+        """ Sends several frames to connected socket client (with a single write).
+
+        @param frames: The frames to send.
+        @type frames: C{list} of C{stompclient.frame.Frame}
+
+        @raise ClientDisconnected: if writing to the socket has failed.
+        """
+        if self._closed.is_set():
+            raise ClientDisconnected()
+        self._out_q.put(b''.join(frame.pack() for frame in frames))
+
+    def _write_loop(self):
+        """
+        Writes the queued (packed) frames to the socket, until a C{None} sentinel is queued.
+
+        If writing fails the connection is marked closed and the socket is shut down, which
+        ends the read loop and (in turn) unbinds the engine.  Anything queued after that is
+        discarded, so that senders never block on a full queue.
+        """
+        while True:
+            packed = self._out_q.get()
+            if packed is None:
+                break
+            if self._closed.is_set():
+                continue
+            if self.debug:  # pragma: no cover
+                self.log.debug("SEND: %r", packed)
+            try:
+                self.request.sendall(packed)
+            except Exception as e:
+                self.log.error("Error sending data (closing connection): %s", e)
+                self._closed.set()
+                try:
+                    self.request.shutdown(socket.SHUT_RDWR)
+                except socket.error:  # pragma: no cover
+                    pass
 
 
 class StompServer(TCPServer):
@@ -145,6 +145,37 @@ class QueueStore(object):
         """
         return QueueFrameIterator(self, destination)
 
+    # This is intentionally not synchronized, since it does not directly
+    # expose any shared data.
+    def drain(self, destination, limit=None):
+        """
+        Removes and returns (up to limit) frames from the specified queue.
+
+        The frames are returned in the order in which L{dequeue} would have returned them.
+        Default implementation calls L{dequeue} for each frame.  Subclasses may choose to
+        optimize this (e.g. by removing the frames in a single operation).
+
+        @param destination: The queue destination (e.g. /queue/foo)
+        @type destination: C{str}
+
+        @param limit: The maximum number of frames to remove (or C{None} for no limit).
+        @type limit: C{int}
+
+        @raise ValueError: if the limit is less than 1.
+
+        @return: The removed frames (empty if there were no frames in queue).
+        @rtype: C{list} of C{stompclient.frame.Frame}
+        """
+        if limit is not None and limit < 1:
+            raise ValueError("Invalid limit: %r" % limit)
+        frames = []
+        while limit is None or len(frames) < limit:
+            frame = self.dequeue(destination)
+            if not frame:
+                break
+            frames.append(frame)
+        return frames
+
 
 class QueueFrameIterator(object):
     """
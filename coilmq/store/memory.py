@@ -50,6 +50,25 @@ class MemoryQueue(QueueStore):
         except IndexError:
             return None
 
+    @synchronized(lock)
+    def drain(self, destination, limit=None):
+        """
+        Removes and returns (up to limit) frames from the specified queue.
+
+        @param destination: The queue destination (e.g. /queue/foo)
+        @type destination: C{str}
+
+        @param limit: The maximum number of frames to remove (or C{None} for no limit).
+        @type limit: C{int}
+
+        @raise ValueError: if the limit is less than 1.
+        """
+        if limit is not None and limit < 1:
+            raise ValueError("Invalid limit: %r" % limit)
+        messages = self._messages[destination]
+        count = len(messages) if limit is None else min(limit, len(messages))
+        return [messages.pop() for _ in range(count)]
+
     @synchronized(lock)
     def size(self, destination):
         """
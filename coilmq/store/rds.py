@@ -52,6 +52,32 @@ class RedisQueueStore(QueueStore):
         if item:
             return pickle.loads(item)
 
+    @synchronized(lock)
+    def drain(self, destination, limit=None):
+        """
+        Removes and returns (up to limit) frames from the specified queue, in a single
+        (pipelined) round-trip.
+
+        @param destination: The queue destination (e.g. /queue/foo)
+        @type destination: C{str}
+
+        @param limit: The maximum number of frames to remove (or C{None} for no limit).
+        @type limit: C{int}
+
+        @raise ValueError: if the limit is less than 1.
+        """
+        if limit is not None and limit < 1:
+            raise ValueError("Invalid limit: %r" % limit)
+        pipe = self.__db.pipeline()
+        if limit is None:
+            pipe.lrange(destination, 0, -1)
+            pipe.delete(destination)
+        else:
+            pipe.lrange(destination, 0, limit - 1)
+            pipe.ltrim(destination, limit, -1)
+        items = pipe.execute()[0]
+        return [pickle.loads(item) for item in items]
+
     @synchronized(lock)
     def requeue(self, destination, frame):
         self.enqueue(destination, frame)
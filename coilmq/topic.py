@@ -9,8 +9,6 @@ import threading
 import uuid
 from collections import defaultdict
 
-from coilmq.util.concurrency import synchronized
-
 __authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
 __copyright__ = "Copyright 2009 Hans Lellelid"
 __license__ = """Licensed under the Apache License, Version 2.0 (the "License");
@@ -25,14 +23,12 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License."""
 
-lock = threading.RLock()
-
 
 class TopicManager(object):
     """
     Class that manages distribution of messages to topic subscribers.
 
-    This class uses C{threading.RLock} to guard the public methods.  This is probably
+    This class uses a C{threading.RLock} to guard the public methods.  This is probably
     a bit excessive, given 1) the actomic nature of basic C{dict} read/write operations 
     and  2) the fact that most of the internal data structures are keying off of the 
     STOMP connection, which is going to be thread-isolated.  That said, this seems like 
@@ -47,23 +43,22 @@ class TopicManager(object):
         self.log = logging.getLogger(
             '%s.%s' % (__name__, self.__class__.__name__))
 
-        # Lock var is required for L{synchornized} decorator.
+        # (Re-entrant, since send() may disconnect bad subscribers.)
         self._lock = threading.RLock()
 
         self._topics = defaultdict(set)
 
         # TODO: If we want durable topics, we'll need a store for topics.
 
-    @synchronized(lock)
     def close(self):
         """
         Closes all resources associated with this topic manager.
 
         (Currently this is simply here for API conformity w/ L{coilmq.queue.QueueManager}.)
         """
-        self.log.info("Shutting down topic manager.")  # pragma: no cover
+        with self._lock:
+            self.log.info("Shutting down topic manager.")  # pragma: no cover
 
-    @synchronized(lock)
     def subscribe(self, connection, destination):
         """
         Subscribes a connection to the specified topic destination. 
@@ -74,10 +69,10 @@ class TopicManager(object):
         @param destination: The topic destination (e.g. '/topic/foo')
         @type destination: C{str} 
         """
-        self.log.debug("Subscribing %s to %s" % (connection, destination))
-        self._topics[destination].add(connection)
+        with self._lock:
+            self.log.debug("Subscribing %s to %s", connection, destination)
+            self._topics[destination].add(connection)
 
-    @synchronized(lock)
     def unsubscribe(self, connection, destination):
         """
         Unsubscribes a connection from the specified topic destination. 
@@ -88,14 +83,15 @@ class TopicManager(object):
         @param destination: The topic destination (e.g. '/topic/foo')
         @type destination: C{str} 
         """
-        self.log.debug("Unsubscribing %s from %s" % (connection, destination))
-        if connection in self._topics[destination]:
-            self._topics[destination].remove(connection)
+        with self._lock:
+            self.log.debug("Unsubscribing %s from %s", connection, destination)
+            subscribers = self._topics.get(destination)
+            if subscribers is None:
+                return
+            subscribers.discard(connection)
+            if not subscribers:
+                del self._topics[destination]
 
-        if not self._topics[destination]:
-            del self._topics[destination]
-
-    @synchronized(lock)
     def disconnect(self, connection):
         """
         Removes a subscriber connection.
@@ -103,15 +99,15 @@ class TopicManager(object):
         @param connection: The client connection to unsubscribe.
         @type connection: L{coilmq.server.StompConnection}
         """
-        self.log.debug("Disconnecting %s" % connection)
-        for dest in list(self._topics.keys()):
-            if connection in self._topics[dest]:
-                self._topics[dest].remove(connection)
-            if not self._topics[dest]:
-                # This won't trigger RuntimeError, since we're using keys()
-                del self._topics[dest]
-
-    @synchronized(lock)
+        with self._lock:
+            self.log.debug("Disconnecting %s", connection)
+            for dest in list(self._topics.keys()):
+                subscribers = self._topics[dest]
+                subscribers.discard(connection)
+                if not subscribers:
+                    # This won't trigger RuntimeError, since we're using keys()
+                    del self._topics[dest]
+
     def send(self, message):
         """
         Sends a message to all subscribers of destination.
@@ -120,25 +116,26 @@ class TopicManager(object):
                             to MESSAGE and set a message id.)
         @type message: L{stompclient.frame.Frame}
         """
-        dest = message.headers.get('destination')
-        if not dest:
-            raise ValueError(
-                "Cannot send frame with no destination: %s" % message)
-
-        message.cmd = 'message'
-
-        message.headers.setdefault('message-id', str(uuid.uuid4()))
-
-        bad_subscribers = set()
-        for subscriber in self._topics[dest]:
-            try:
-                subscriber.send_frame(message)
-            except:
-                self.log.exception(
-                    "Error delivering message to subscriber %s; client will be disconnected." % subscriber)
-                # We queue for deletion so we are not modifying the topics dict
-                # while iterating over it.
-                bad_subscribers.add(subscriber)
-
-        for subscriber in bad_subscribers:
-            self.disconnect(subscriber)
+        with self._lock:
+            dest = message.headers.get('destination')
+            if not dest:
+                raise ValueError(
+                    "Cannot send frame with no destination: %s" % message)
+
+            message.cmd = 'message'
+
+            message.headers.setdefault('message-id', str(uuid.uuid4()))
+
+            bad_subscribers = set()
+            for subscriber in self._topics[dest]:
+                try:
+                    subscriber.send_frame(message)
+                except:
+                    self.log.exception(
+                        "Error delivering message to subscriber %s; client will be disconnected.", subscriber)
+                    # We queue for deletion so we are not modifying the topics dict
+                    # while iterating over it.
+                    bad_subscribers.add(subscriber)
+
+            for subscriber in bad_subscribers:
+                self.disconnect(subscriber)
@@ -29,6 +29,9 @@ class MockConnection(object):
     def send_frame(self, frame):
         self.frames.append(frame)
 
+    def send_frames(self, frames):
+        self.frames.extend(frames)
+
     def reset(self):
         self.frames = []
 
@@ -117,6 +117,28 @@ class CommonQueueTest(object):
         self.assertFalse(self.store.has_frames(dest))
         self.assertEqual(self.store.size(dest), 0)
 
+    def test_drain(self):
+        """ Test removing several frames with the drain() method. """
+        dest = '/queue/foo'
+
+        enqueued = []
+        for i in range(5):
+            frame = Frame('MESSAGE', headers={
+                          'message-id': str(uuid.uuid4())}, body='message-%d' % i)
+            self.store.enqueue(dest, frame)
+            enqueued.append(frame)
+
+        self.assertEqual(self.store.drain(dest, 2), enqueued[:2])
+        self.assertEqual(self.store.size(dest), 3)
+
+        self.assertEqual(self.store.drain(dest), enqueued[2:])
+        self.assertFalse(self.store.has_frames(dest))
+        self.assertEqual(self.store.drain(dest), [])
+
+        self.store.enqueue(dest, enqueued[0])
+        self.assertRaises(ValueError, self.store.drain, dest, 0)
+        self.assertEqual(self.store.size(dest), 1)
+
     def test_dequeue_empty(self):
         """ Test dequeue() with empty queue. """
 
@@ -11,6 +11,7 @@ except ImportError:
 
 from pkg_resources import resource_stream, resource_filename
 
+from coilmq.auth import Authenticator
 from coilmq.auth.simple import SimpleAuthenticator
 
 __authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
@@ -36,6 +37,13 @@ class SimpleAuthenticatorTest(unittest.TestCase):
     def tearDown(self):
         pass
 
+    def test_abstract(self):
+        """ Test that the authenticator base class cannot be instantiated. """
+        self.assertRaises(TypeError, Authenticator)
+
+        auth = SimpleAuthenticator()
+        self.assertFalse(hasattr(auth, '__dict__'))
+
     def test_constructor(self):
         """
         Test the with passing auth store in constructor.
@@ -124,6 +124,14 @@ class EngineTest(unittest.TestCase):
         assert self.conn.reliable_subscriber == True
         assert self.conn in self.qm.queues['/queue/bar']
 
+    def test_subscribe_auto_ack(self):
+        """ Test subscribing to a queue with ack=auto """
+        self._connect()
+        self.engine.process_frame(Frame('SUBSCRIBE', headers={'destination': '/queue/bar',
+                                                              'ack': 'auto'}))
+        assert self.conn.reliable_subscriber == False
+        assert self.conn in self.qm.queues['/queue/bar']
+
     def test_unsubscribe(self):
         """ Test the UNSUBSCRIBE command. """
         self._connect()
@@ -4,6 +4,8 @@ Tests for queue-related classes.
 import unittest
 import uuid
 
+from six.moves import intern
+
 from coilmq.queue import QueueManager
 from coilmq.store.memory import MemoryQueue
 from coilmq.util import frames
@@ -79,6 +81,87 @@ class QueueManagerTest(unittest.TestCase):
         self.assertEqual(len(self.conn.frames), 1)
         self.assertEqual(len(self.store.frames(dest)), 1)
 
+    def test_subscriber_count(self):
+        """ Test counting the subscribers as they subscribe, unsubscribe and disconnect. """
+        dest = '/queue/subscriber-count'
+        conn1 = MockConnection()
+
+        self.qm.subscribe(self.conn, dest)
+        self.qm.subscribe(conn1, dest)
+        self.assertEqual(self.qm.subscriber_count(dest), 2)
+        self.assertEqual(self.qm.subscriber_count(), 2)
+
+        self.qm.unsubscribe(self.conn, dest)
+        self.assertEqual(self.qm.subscriber_count(), 1)
+
+        self.qm.disconnect(conn1)
+        self.assertEqual(self.qm.subscriber_count(), 0)
+        self.assertNotIn(dest, self.qm._queues)
+
+    def test_unsubscribe_pending_frame_redelivered(self):
+        """ Test that a frame taken back on unsubscribe is delivered to an eligible subscriber. """
+        dest = '/queue/unsubscribe-redelivered'
+        conn1 = MockConnection()
+        conn1.reliable_subscriber = True
+        conn2 = MockConnection()
+
+        self.qm.subscribe(conn1, dest)
+        m1 = Frame(frames.SEND, headers={'destination': dest}, body='Body-X')
+        self.qm.send(m1)
+        self.assertEqual(conn1.frames, [m1])
+
+        self.qm.subscribe(conn2, dest)
+        self.qm.unsubscribe(conn1, dest)
+        self.assertEqual(conn2.frames, [m1])
+
+        for i in range(3):
+            self.qm.send(Frame(frames.SEND, headers={'destination': dest}, body='Body-%d' % i))
+        self.assertEqual(len(conn2.frames), 4)
+        self.assertFalse(self.store.has_frames(dest))
+
+    def test_disconnect_pending_frame_redelivered(self):
+        """ Test that a frame taken back on disconnect is delivered to an eligible subscriber. """
+        dest = '/queue/disconnect-redelivered'
+        conn1 = MockConnection()
+        conn1.reliable_subscriber = True
+        conn2 = MockConnection()
+
+        self.qm.subscribe(conn1, dest)
+        m1 = Frame(frames.SEND, headers={'destination': dest}, body='Body-X')
+        self.qm.send(m1)
+
+        self.qm.subscribe(conn2, dest)
+        self.qm.disconnect(conn1)
+        self.assertEqual(conn2.frames, [m1])
+        self.assertFalse(self.store.has_frames(dest))
+
+    def test_unsubscribe_unknown(self):
+        """ Test unsubscribing from a destination that has no subscribers. """
+        dest = '/queue/unsubscribe-unknown'
+
+        self.qm.unsubscribe(self.conn, dest)
+        self.assertNotIn(dest, self.qm._queues)
+        self.assertNotIn(dest, self.qm._free)
+        self.assertNotIn(dest, self.qm._dest_locks)
+
+    def test_unsubscribe_pending_frames(self):
+        """ Test unsubscribing a reliable connection that has a pending frame. """
+        dest = '/queue/unsubscribe-pending-frames'
+        conn1 = MockConnection()
+        conn1.reliable_subscriber = True
+
+        self.qm.subscribe(conn1, dest)
+        f = Frame(frames.MESSAGE, headers={'destination': dest}, body='Empty')
+        self.qm.send(f)
+        self.assertEqual(conn1.frames, [f])
+
+        self.qm.unsubscribe(conn1, dest)
+        self.assertEqual(len(self.store.frames(dest)), 1)
+        self.assertNotIn(dest, conn1.pending_frames)
+
+        self.qm.subscribe(self.conn, dest)
+        self.assertEqual(self.conn.frames, [f])
+
     def send_simple(self):
         """ Test a basic send command. """
         dest = '/queue/dest'
@@ -93,6 +176,55 @@ class QueueManagerTest(unittest.TestCase):
         self.assertIn('message-id', f.headers)
         self.assertEqual(f.command, frames.MESSAGE)
 
+    def test_send_no_destination(self):
+        """ Test that sending a frame without a destination is rejected. """
+        f = Frame(frames.SEND, headers={}, body='Empty')
+        self.assertRaises(ValueError, self.qm.send, f)
+
+        f = Frame(frames.SEND, headers={'destination': ''}, body='Empty')
+        self.assertRaises(ValueError, self.qm.send, f)
+
+    def test_send_interned_destination(self):
+        """ Test that equal destinations share the same (interned) key. """
+        dest = ''.join(['/queue/', 'interned'])
+        self.qm.subscribe(self.conn, dest)
+
+        other = ''.join(['/queue/', 'interned'])
+        self.assertIsNot(dest, other)
+        f = Frame(frames.SEND, headers={'destination': other}, body='Empty')
+        self.qm.send(f)
+
+        self.assertEqual(self.conn.frames, [f])
+        key = [k for k in self.qm._queues if k == other][0]
+        self.assertIs(key, intern(other))
+
+    def test_send_non_str_destination(self):
+        """ Test destinations that cannot be interned (e.g. C{str} subclasses). """
+
+        class Destination(str):
+            pass
+
+        dest = Destination('/queue/not-interned')
+        self.qm.subscribe(self.conn, dest)
+        f = Frame(frames.SEND, headers={'destination': Destination(dest)}, body='Empty')
+        self.qm.send(f)
+
+        self.assertEqual(self.conn.frames, [f])
+
+    def test_send_message_id(self):
+        """ Test that sent messages get a unique message-id (unless they have one). """
+        dest = '/queue/message-id'
+
+        f1 = Frame(frames.SEND, headers={'destination': dest}, body='Empty')
+        f2 = Frame(frames.SEND, headers={'destination': dest}, body='Empty')
+        f3 = Frame(frames.SEND, headers={'destination': dest, 'message-id': 'abc'}, body='Empty')
+        for f in (f1, f2, f3):
+            self.qm.send(f)
+
+        self.assertTrue(f1.headers['message-id'])
+        self.assertNotEqual(f1.headers['message-id'], f2.headers['message-id'])
+        self.assertEqual(f3.headers['message-id'], 'abc')
+
     def test_send_err(self):
         """ Test sending a message when delivery results in error. """
 
@@ -176,6 +308,67 @@ class QueueManagerTest(unittest.TestCase):
         self.assertEqual(len(self.conn.frames), 2, "Expected frame to be delivered")
         self.assertListEqual(list(self.conn.frames), [f2, f])
 
+    def test_backlog_batch_size_invalid(self):
+        """ Test that a backlog batch size less than 1 is rejected. """
+        self.assertRaises(ValueError, QueueManager, self.store, backlog_batch_size=0)
+
+    def test_send_backlog_batches(self):
+        """ Test sending backlog to a non-reliable subscriber in batches. """
+
+        class BatchConn(MockConnection):
+
+            def __init__(self):
+                MockConnection.__init__(self)
+                self.batches = []
+
+            def send_frames(self, frames):
+                self.batches.append(len(frames))
+                MockConnection.send_frames(self, frames)
+
+        dest = '/queue/send-backlog-batches'
+        self.qm.backlog_batch_size = 2
+
+        sent = []
+        for i in range(5):
+            f = Frame(frames.SEND, headers={'destination': dest}, body='Body-%d' % i)
+            self.qm.send(f)
+            sent.append(f)
+
+        conn = BatchConn()
+        self.qm.subscribe(conn, dest)
+
+        self.assertEqual(conn.frames, sent)
+        self.assertEqual(conn.batches, [2, 2, 1])
+        self.assertFalse(self.store.has_frames(dest))
+
+    def test_send_backlog_batches_err(self):
+        """ Test errors when sending a backlog batch to a non-reliable subscriber. """
+
+        class ExcThrowingConn(object):
+            reliable_subscriber = False
+
+            def send_frame(self, frame):
+                raise RuntimeError("Error sending data.")
+
+            def send_frames(self, frames):
+                raise RuntimeError("Error sending data.")
+
+        dest = '/queue/send-backlog-batches-err'
+
+        f = Frame(frames.SEND, headers={'destination': dest}, body='123')
+        self.qm.send(f)
+
+        f2 = Frame(frames.SEND, headers={'destination': dest}, body='12345')
+        self.qm.send(f2)
+
+        self.assertRaises(RuntimeError, self.qm.subscribe, ExcThrowingConn(), dest)
+
+        # The messages will have been requeued (in order) at this point, so add
+        # a valid subscriber
+        self.qm.subscribe(self.conn, dest)
+
+        self.assertEqual(self.conn.frames, [f, f2])
+
     def test_send_reliableFirst(self):
         """
         Test that messages are prioritized to reliable subscribers.
@@ -219,6 +412,36 @@ class QueueManagerTest(unittest.TestCase):
 
         self.qm.clear_transaction_frames(conn1, '1')
 
+    def test_clear_transaction_frames_acked(self):
+        """ Test the clearing of transaction ACK frames after an ACK. """
+        dest = '/queue/tx-acked'
+
+        conn1 = MockConnection()
+        conn1.reliable_subscriber = True
+        self.qm.subscribe(conn1, dest)
+
+        m1 = Frame(frames.MESSAGE, headers={'destination': dest}, body='Body-A')
+        self.qm.send(m1)
+
+        ack = Frame(frames.ACK, headers={'message-id': m1.headers['message-id']})
+        self.qm.ack(conn1, ack, transaction='1')
+        self.assertEqual(self.qm._transaction_frames[conn1]['1'], [m1])
+
+        self.qm.clear_transaction_frames(conn1, '1')
+        self.assertEqual(self.qm._transaction_frames, {})
+
+        # Aborting now has nothing to resend
+        self.qm.resend_transaction_frames(conn1, '1')
+        self.assertEqual(conn1.frames, [m1])
+
+        # A disconnect discards any frames from open transactions
+        m2 = Frame(frames.MESSAGE, headers={'destination': dest}, body='Body-B')
+        self.qm.send(m2)
+        ack = Frame(frames.ACK, headers={'message-id': m2.headers['message-id']})
+        self.qm.ack(conn1, ack, transaction='2')
+        self.qm.disconnect(conn1)
+        self.assertEqual(self.qm._transaction_frames, {})
+
     def test_ack_basic(self):
         """ Test reliable client (ACK) behavior. """
 
@@ -285,7 +508,185 @@ class QueueManagerTest(unittest.TestCase):
         self.qm.resend_transaction_frames(conn1, transaction='abc')
 
         self.assertEqual(len(conn1.frames), 3, "Expected 3 frames after re-transmit.")
-        self.assertTrue(self.qm._pending[conn1], "Expected 1 pending (waiting on ACK) frame.""")
+        self.assertTrue(conn1.pending_frames[dest], "Expected 1 pending (waiting on ACK) frame.""")
+        self.assertNotIn(conn1, self.qm._transaction_frames)
+
+    def test_ack_per_destination(self):
+        """ Test that a reliable client has a pending frame per destination. """
+
+        dest1 = '/queue/ack-dest-1'
+        dest2 = '/queue/ack-dest-2'
+        conn1 = MockConnection()
+        conn1.reliable_subscriber = True
+
+        self.qm.subscribe(conn1, dest1)
+        self.qm.subscribe(conn1, dest2)
+
+        m1 = Frame(frames.MESSAGE, headers={
+                   'destination': dest1}, body='Message body (1)')
+        self.qm.send(m1)
+        m2 = Frame(frames.MESSAGE, headers={
+                   'destination': dest2}, body='Message body (2)')
+        self.qm.send(m2)
+        m3 = Frame(frames.MESSAGE, headers={
+                   'destination': dest2}, body='Message body (3)')
+        self.qm.send(m3)
+
+        self.assertEqual(conn1.frames, [m1, m2])
+
+        ack = Frame(frames.ACK, headers={'message-id': m2.headers['message-id']})
+        self.qm.ack(conn1, ack)
+
+        self.assertEqual(conn1.frames, [m1, m2, m3])
+        self.assertEqual(conn1.pending_frames[dest1], m1)
+
+    def test_ack_unexpected(self):
+        """ Test that a duplicate or unknown ACK leaves the pending frames pending. """
+        dest1 = '/queue/ack-unexpected-1'
+        dest2 = '/queue/ack-unexpected-2'
+        conn1 = MockConnection()
+        conn1.reliable_subscriber = True
+
+        self.qm.subscribe(conn1, dest1)
+        self.qm.subscribe(conn1, dest2)
+
+        m1 = Frame(frames.MESSAGE, headers={'destination': dest1}, body='Body-A')
+        self.qm.send(m1)
+        m2 = Frame(frames.MESSAGE, headers={'destination': dest2}, body='Body-B')
+        self.qm.send(m2)
+
+        ack = Frame(frames.ACK, headers={'message-id': m1.headers['message-id']})
+        self.qm.ack(conn1, ack)
+        self.qm.ack(conn1, ack)
+        self.qm.ack(conn1, Frame(frames.ACK, headers={'message-id': 'unknown'}))
+
+        self.assertEqual(conn1.pending_frames, {dest2: m2})
+        self.assertNotIn(conn1, self.qm._free[dest2])
+        self.assertFalse(self.store.has_frames(dest2))
+
+    def test_ack_backlog_subscribed_only(self):
+        """ Test that the backlog after an ACK only considers subscribed destinations. """
+
+        dest = '/queue/ack-backlog'
+        other = '/queue/ack-backlog-other'
+        conn1 = MockConnection()
+        conn1.reliable_subscriber = True
+
+        self.qm.subscribe(conn1, dest)
+        self.qm.subscribe(conn1, other)
+        self.qm.unsubscribe(conn1, other)
+
+        m1 = Frame(frames.MESSAGE, headers={'destination': dest}, body='Message body (1)')
+        self.qm.send(m1)
+        self.qm.send(Frame(frames.MESSAGE, headers={'destination': other}, body='Other body'))
+
+        ack = Frame(frames.ACK, headers={'message-id': m1.headers['message-id']})
+        self.qm.ack(conn1, ack)
+
+        self.assertEqual(conn1.frames, [m1])
+        self.assertEqual(self.qm._conn_subs[conn1], set([dest]))
+        self.assertEqual(len(self.store.frames(other)), 1)
+
+        self.qm.disconnect(conn1)
+        self.assertNotIn(conn1, self.qm._conn_subs)
+
+    def test_free_subscribers(self):
+        """ Test tracking of the subscribers without pending frames. """
+
+        dest = '/queue/free-subscribers'
+        conn1 = MockConnection()
+        conn1.reliable_subscriber = True
+
+        self.qm.subscribe(conn1, dest)
+        self.qm.subscribe(self.conn, dest)
+        self.assertEqual(self.qm._free[dest], set([conn1, self.conn]))
+
+        m1 = Frame(frames.MESSAGE, headers={'destination': dest}, body='Message body (1)')
+        self.qm.send(m1)
+        self.assertEqual(conn1.frames, [m1])
+        self.assertEqual(self.qm._free[dest], set([self.conn]))
+
+        m2 = Frame(frames.MESSAGE, headers={'destination': dest}, body='Message body (2)')
+        self.qm.send(m2)
+        self.assertEqual(self.conn.frames, [m2])
+
+        ack = Frame(frames.ACK, headers={'message-id': m1.headers['message-id']})
+        self.qm.ack(conn1, ack)
+        self.assertEqual(self.qm._free[dest], set([conn1, self.conn]))
+
+        self.qm.unsubscribe(self.conn, dest)
+        self.assertEqual(self.qm._free[dest], set([conn1]))
+
+        self.qm.disconnect(conn1)
+        self.assertNotIn(dest, self.qm._free)
+
+    def test_requeue_unlocked(self):
+        """ Test that pending frames are requeued without holding the destination lock. """
+        dest = '/queue/requeue-unlocked'
+        locked = []
+
+        def requeue(destination, frame):
+            locked.append(self.qm._lock_for(destination).locked())
+            self.store.enqueue(destination, frame)
+        self.store.requeue = requeue
+
+        conn1 = MockConnection()
+        conn1.reliable_subscriber = True
+        self.qm.subscribe(conn1, dest)
+        self.qm.send(Frame(frames.SEND, headers={'destination': dest}, body='Body-A'))
+        self.qm.unsubscribe(conn1, dest)
+
+        conn2 = MockConnection()
+        conn2.reliable_subscriber = True
+        self.qm.subscribe(conn2, dest)
+        self.assertEqual(len(conn2.frames), 1)
+
+        # The frame is delivered to the remaining (eligible) subscriber afterwards
+        conn3 = MockConnection()
+        self.qm.subscribe(conn3, dest)
+        self.qm.disconnect(conn2)
+
+        self.assertEqual(locked, [False, False])
+        self.assertEqual(conn3.frames, conn2.frames)
+        self.assertFalse(self.store.has_frames(dest))
+
+    def test_requeue_subscribe_race(self):
+        """ Test a subscribe between taking back a pending frame and requeueing it. """
+        dest = '/queue/requeue-subscribe-race'
+        conn1 = MockConnection()
+        conn1.reliable_subscriber = True
+        conn2 = MockConnection()
+
+        def requeue(destination, frame):
+            # The new subscriber does not find any backlog (yet)
+            self.qm.subscribe(conn2, destination)
+            self.assertEqual(conn2.frames, [])
+            self.store.enqueue(destination, frame)
+        self.store.requeue = requeue
+
+        self.qm.subscribe(conn1, dest)
+        m1 = Frame(frames.SEND, headers={'destination': dest}, body='Body-A')
+        self.qm.send(m1)
+        self.qm.unsubscribe(conn1, dest)
+
+        self.assertEqual(conn2.frames, [m1])
+        self.assertFalse(self.store.has_frames(dest))
+
+    def test_unreliable_no_pending(self):
+        """ Test that no frames are tracked as pending for a non-reliable subscriber. """
+        dest = '/queue/no-ack'
+
+        self.qm.subscribe(self.conn, dest)
+        m1 = Frame(frames.SEND, headers={'destination': dest}, body='Body')
+        self.qm.send(m1)
+
+        self.assertEqual(self.conn.frames, [m1])
+        self.assertEqual(self.conn.pending_frames, {})
+        self.assertIn(self.conn, self.qm._free[dest])
+
+        # An ACK has nothing to do
+        self.qm.ack(self.conn, Frame(frames.ACK, headers={'message-id': m1.headers['message-id']}))
+        self.assertEqual(self.conn.frames, [m1])
 
     def test_disconnect_pending_frames(self):
         """ Test a queue disconnect when there are pending frames. """
@@ -3,7 +3,7 @@ Tests for the scheduler implementation.
 """
 import unittest
 
-from coilmq.scheduler import FavorReliableSubscriberScheduler
+from coilmq.scheduler import FavorReliableSubscriberScheduler, RandomSubscriberScheduler
 from tests.mock import MockConnection
 
 __authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
@@ -39,3 +39,13 @@ class QueueDeliverySchedulerTest(unittest.TestCase):
 
         self.assertIs(
             choice, conn1, "Expected reliable connection to be selected.")
+
+    def test_choice_set(self):
+        """ Test that the subscriber schedulers accept a C{set} of subscribers. """
+
+        conn1 = MockConnection()
+        conn2 = MockConnection()
+
+        for sched in (FavorReliableSubscriberScheduler(), RandomSubscriberScheduler()):
+            self.assertIn(sched.choice(set([conn1, conn2]), None), (conn1, conn2))
+            self.assertIsNone(sched.choice(set(), None))
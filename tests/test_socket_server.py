@@ -0,0 +1,92 @@
+"""
+Tests for the socket server request handler.
+"""
+import socket
+import unittest
+
+from coilmq.exception import ClientDisconnected
+from coilmq.protocol import STOMP10
+from coilmq.server.socket_server import StompRequestHandler
+from coilmq.util import frames
+from coilmq.util.frames import Frame
+from tests.mock import MockQueueManager, MockTopicManager
+
+__authors__ = ['"Hans Lellelid" <hans@xmpl.org>']
+__copyright__ = "Copyright 2009 Hans Lellelid"
+__license__ = """Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+  http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License."""
+
+
+class MockServer(object):
+
+    timeout = None
+    authenticator = None
+    protocol = STOMP10
+
+    def __init__(self):
+        self.queue_manager = MockQueueManager()
+        self.topic_manager = MockTopicManager()
+
+
+class MockSocket(object):
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+        self.shut_down = False
+
+    def sendall(self, data):
+        if self.fail:
+            raise socket.error("Broken pipe")
+        self.sent.append(data)
+
+    def shutdown(self, how):
+        self.shut_down = True
+
+
+class StompRequestHandlerTest(unittest.TestCase):
+    """ Test the writing of frames by the StompRequestHandler class. """
+
+    def _handler(self, request):
+        # (The constructor would immediately handle the request.)
+        handler = StompRequestHandler.__new__(StompRequestHandler)
+        handler.request = request
+        handler.server = MockServer()
+        handler.setup()
+        return handler
+
+    def test_send_frames(self):
+        """ Test that queued frames are written to the socket. """
+        sock = MockSocket()
+        handler = self._handler(sock)
+
+        f1 = Frame(frames.MESSAGE, headers={'destination': '/queue/a'}, body='Body-A')
+        f2 = Frame(frames.MESSAGE, headers={'destination': '/queue/a'}, body='Body-B')
+        handler.send_frame(f1)
+        handler.send_frames([f1, f2])
+        handler.finish()
+
+        self.assertEqual(sock.sent, [f1.pack(), f1.pack() + f2.pack()])
+
+    def test_send_err(self):
+        """ Test that sending raises once writing to the socket has failed. """
+        sock = MockSocket(fail=True)
+        handler = self._handler(sock)
+        self.addCleanup(handler.finish)
+
+        f = Frame(frames.MESSAGE, headers={'destination': '/queue/a'}, body='Body')
+        handler.send_frame(f)
+        self.assertTrue(handler._closed.wait(5))
+
+        self.assertTrue(sock.shut_down)
+        self.assertRaises(ClientDisconnected, handler.send_frame, f)
+        self.assertRaises(ClientDisconnected, handler.send_frames, [f])